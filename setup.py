@@ -5,6 +5,7 @@ requires = [r.replace(' = "*"','').strip() for r in open('Pipfile').readlines()
 
 setup(name='steam-cli', url='https://github.com/berenm/steam-cli',
 	license='UNLICENSE',
+  python_requires='>=3.11',
   install_requires=requires,
   py_modules=['steam_cli'],
   entry_points={'console_scripts': ['steam-cli=steam_cli:main']},
@@ -44,15 +44,23 @@ Options:
 
 import os
 import re
+import codecs
 import sys
-import json
 import getpass
 import shutil
 import subprocess
 import contextlib
 import datetime
+import time
 import asyncio
+import random
 import tempfile
+import sqlite3
+import pickle
+import mmap
+import math
+import itertools
+import concurrent.futures
 
 import docopt
 import dateutil.parser
@@ -60,9 +68,52 @@ import requests
 import pexpect
 import xdg
 import vdf
+import orjson
+
+json_loads = orjson.loads
+
+
+def json_dumps(obj, indent=False):
+  option = orjson.OPT_INDENT_2 if indent else 0
+  return orjson.dumps(obj, option=option).decode('utf-8')
+
 
 STEAM_DIR = os.path.expandvars("$HOME/.steam")
 CACHE_DIR = os.path.join(xdg.XDG_CACHE_HOME, "steam-cli")
+CACHE_VERSION = 4
+PKG_KEYS = {'appids'}
+SHARD_SIZE = 128
+POOL_THRESHOLD = 256
+DB_MMAP_SIZE = 1 << 28
+DOWNLOAD_ATTEMPTS = 5
+PROGRESS_INTERVAL = 0.05
+LEVELDB_PREFIX = b'_https://steamloopback.host\x00\x01'
+PROGRESS_BARS = ['#' * int(p / 2) + ' ' * int(50 - (p + 1) / 2)
+                 for p in range(101)]
+
+PROMPT_RE = re.compile(r'\x1b\[1m\r\nSteam>\x1b\[0m')
+LEGACY_CACHE_RE = re.compile(r'(?:pkg|app)-\d+\.vdf|(?:pkgs|apps)\.json')
+BLOCK_RE = re.compile(r'"(\d+)"\r\n{\r\n((?:[^\n]*\r\n)*?)}\r\n')
+UPDATE_RE = re.compile(r'\[([^\]]+)\] (Checking for available update|'
+                       r'Downloading [Uu]pdate|Download complete)[^\n]+\r\n')
+LICENSE_RE = re.compile(r'License packageID (\d+):\r\n')
+LOGIN_RES = [re.compile(r'password:'),
+             re.compile(r'Steam Guard code:'),
+             re.compile(r'Two-factor code:'),
+             re.compile(r'Logged in OK\r\n'),
+             re.compile(r'FAILED login with result code ([^\n]+)\r\n'),
+             re.compile(r"Logging in user '.*' to Steam Public \.\.\.\r\n",
+                        re.DOTALL),
+             re.compile(r'Waiting for user info\.\.\.OK\r\n')]
+INSTALL_RES = [re.compile(r'Update state .* (reconfiguring|downloading|'
+                          r'validating), progress: ([\d]+).*\r\n', re.DOTALL),
+               re.compile(r"Success! App '\d+' fully installed\.\r\n")]
+
+VDF_TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|([{}]|\S)')
+VDF_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+VDF_UNESCAPE = {'n': '\n', 't': '\t', 'v': '\v', 'b': '\b', 'r': '\r',
+                'f': '\f', 'a': '\a', '\\': '\\', '?': '?', '"': '"',
+                "'": "'"}
 
 if not os.path.exists(CACHE_DIR):
   os.makedirs(CACHE_DIR)
@@ -72,6 +123,9 @@ def progress(ui):
   _txt = '...'
   _pct = 0
   _cmd = None
+  _msg = None
+  _time = 0
+  _pending = None
 
   def message(fmt, pct, txt):
     nonlocal _txt
@@ -83,15 +137,35 @@ def progress(ui):
     elif pct >= 0:
       _pct = min(pct, 99)
     else:
-      _pct += -pct
-    bar = '#' * int(_pct / 2) + ' ' * int(50 - (_pct + 1) / 2)
-    return fmt.format(pct=int(_pct), txt=_txt, bar=bar)
+      _pct = min(_pct - pct, 100)
+    return fmt.format(pct=int(_pct), txt=_txt, bar=PROGRESS_BARS[int(_pct)])
+
+  def emit(fmt, file=lambda: None, end='\n'):
+    def write(msg):
+      nonlocal _msg
+      nonlocal _time
+      nonlocal _pending
+      _pending = None
+      if msg != _msg:
+        _msg = msg
+        _time = time.monotonic()
+        print(msg, file=file(), end=end)
+
+    def update(pct, txt=None):
+      nonlocal _pending
+      last = _txt
+      msg = message(fmt, pct, txt)
+      done = pct is None or pct >= 100 or _pct >= 100
+      recent = time.monotonic() - _time < PROGRESS_INTERVAL
+      if not done and _txt == last and recent:
+        _pending = lambda: write(msg)
+        return
+      write(msg)
+    return update
 
   try:
     if ui == 'text':
-      yield (lambda pct, txt=None:
-               print(message('\u001b[2K[{bar}] {txt}...', pct, txt),
-                     end='\r'))
+      yield emit('\u001b[2K[{bar}] {txt}...', end='\r')
 
     elif ui == 'curses':
       def cmd():
@@ -101,9 +175,7 @@ def progress(ui):
                                  bufsize=0, stdin=subprocess.PIPE, text=True)
         return _cmd
 
-      yield (lambda pct, txt=None:
-               print(message('XXX\n{pct}\n{txt}...\nXXX', pct, txt),
-                     file=cmd().stdin))
+      yield emit('XXX\n{pct}\n{txt}...\nXXX', lambda: cmd().stdin)
 
     elif ui == 'system':
       def cmd():
@@ -115,53 +187,260 @@ def progress(ui):
                                    bufsize=0, stdin=subprocess.PIPE, text=True)
         return _cmd
 
-      yield (lambda pct, txt=None:
-               print(message('# {txt}...\n{pct}', pct, txt), file=cmd().stdin))
+      yield emit('# {txt}...\n{pct}', lambda: cmd().stdin)
 
     else:
-      yield (lambda pct, txt=None:
-               print(message('{txt}... {pct}%', pct, txt), file=sys.stderr))
+      yield emit('{txt}... {pct}%', lambda: sys.stderr)
 
   finally:
-    pass
+    if _pending:
+      _pending()
 
   if _cmd:
     _cmd.stdin.close()
     _cmd.wait()
 
 
-def trydecode(bytes, encodings=['utf-8', 'iso-8859-1']):
-  for e in encodings[:-1]:
+def latin1_fallback(e):
+  return e.object[e.start:e.end].decode('iso-8859-1'), e.end
+
+
+codecs.register_error('latin1-fallback', latin1_fallback)
+
+
+def unescape(txt):
+  if '\\' not in txt:
+    return txt
+  return VDF_ESCAPE_RE.sub(lambda m: VDF_UNESCAPE.get(m[1], m[0]), txt)
+
+
+def fast_vdf(txt, wanted=None):
+  root = d = {}
+  stack = []
+  key = None
+  skip = 0
+
+  for string, token in VDF_TOKEN_RE.findall(txt):
+    if not token:
+      if '\\' in string:
+        string = unescape(string)
+      if key is None:
+        key = string
+      else:
+        if not skip and (stack or not wanted or key in wanted):
+          d[key] = string
+        key = None
+
+    elif token == '{':
+      if key is None:
+        raise SyntaxError('vdf: unexpected {')
+      if skip or (not stack and wanted and key not in wanted):
+        skip += 1
+      else:
+        sub = d.get(key)
+        if not isinstance(sub, dict):
+          sub = d[key] = {}
+        stack.append(d)
+        d = sub
+      key = None
+
+    elif token == '}':
+      if key is not None or (not skip and not stack):
+        raise SyntaxError('vdf: unexpected }')
+      if skip:
+        skip -= 1
+      else:
+        d = stack.pop()
+
+    else:
+      raise SyntaxError(f'vdf: unexpected {token!r}')
+
+  if key is not None or skip or stack:
+    raise SyntaxError('vdf: unexpected end of input')
+
+  return root
+
+
+def loads_vdf(txt, wanted=None):
+  try:
+    return fast_vdf(txt, wanted)
+  except SyntaxError:
+    return vdf.loads(txt)
+
+
+def parse_blocks(blocks, wanted=None):
+  ids = [i for i,_ in blocks]
+  txts = [s for _,s in blocks]
+  if len(blocks) < POOL_THRESHOLD:
+    return list(zip(ids, (loads_vdf(s, wanted) for s in txts)))
+
+  with concurrent.futures.ProcessPoolExecutor() as ex:
+    return list(zip(ids, ex.map(loads_vdf, txts, itertools.repeat(wanted),
+                                chunksize=32)))
+
+
+def listdir(path):
+  try:
+    with os.scandir(path) as it:
+      return {e.name for e in it}
+  except FileNotFoundError:
+    return set()
+
+
+def disk_usage(path):
+  total = os.lstat(path).st_blocks * 512
+  stack = [path]
+  while stack:
     try:
-      return bytes.decode(e)
-    except:
-      continue
-  return bytes.decode(encodings[-1])
+      with os.scandir(stack.pop()) as it:
+        for e in it:
+          if e.is_dir(follow_symlinks=False):
+            stack.append(e.path)
+          total += e.stat(follow_symlinks=False).st_blocks * 512
+    except OSError:
+      pass
+  return total
+
+
+def human_size(n):
+  for unit in ('', 'K', 'M', 'G', 'T'):
+    if unit and n < 10:
+      tenths = math.ceil(n * 10)
+      if tenths < 100:
+        return f'{tenths / 10:.1f}{unit}'
+    if math.ceil(n) < 1024 or unit == 'T':
+      return f'{math.ceil(n)}{unit}'
+    n /= 1024
+
 
+def pkg_appids(pkgs):
+  return sorted({int(i) for p in pkgs.values() for i in p['appids'].values()})
 
-async def download(session, source, target):
-  if os.path.exists(target) or os.path.exists(target + '~'):
+
+def cloud_storage(db):
+  for k,v in db.iterator(prefix=LEVELDB_PREFIX):
+    if b'-cloud-storage-namespace-' in k and not b'.modified' in k:
+      assert(v[0] == 1)
+      yield k, v
+
+
+def remove_legacy_cache():
+  with os.scandir(CACHE_DIR) as it:
+    for e in it:
+      if LEGACY_CACHE_RE.fullmatch(e.name) and e.is_file(follow_symlinks=False):
+        os.remove(e.path)
+
+
+def read_cache(name):
+  path = os.path.join(CACHE_DIR, f'{name}.pkl')
+  if not os.path.exists(path):
+    return None
+
+  with open(path, 'rb') as f:
+    try:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        unpickler = pickle.Unpickler(m)
+        header = unpickler.load()
+        if header[0] != CACHE_VERSION:
+          return None
+        return dict(unpickler.load() for _ in range(header[1]))
+    except (EOFError, ValueError, TypeError, pickle.UnpicklingError):
+      return None
+
+
+def write_cache(name, data):
+  path = os.path.join(CACHE_DIR, f'{name}.pkl')
+  with open(path + '~', 'wb') as f:
+    pickler = pickle.Pickler(f, protocol=5)
+    pickler.dump((CACHE_VERSION, len(data)))
+    for k in sorted(data):
+      pickler.dump((k, data[k]))
+      pickler.clear_memo()
+  os.replace(path + '~', path)
+
+
+def write_index(apps):
+  names = {}
+  for k,v in apps.items():
+    if 'common' in v and 'gameid' in v['common'] and 'name' in v['common']:
+      names.setdefault(v['common']['name'], int(v['common']['gameid']))
+
+  with open(os.path.join(CACHE_DIR, 'index.json'), 'w') as f:
+    f.write(json_dumps({'names': names, 'ids': list(apps.keys())}))
+
+
+async def download(session, source, target, known):
+  import aiofiles
+  import aiohttp
+
+  name = os.path.basename(target)
+  if name in known or name + '~' in known:
     return
 
-  if not os.path.exists(os.path.dirname(target)):
-    os.makedirs(os.path.dirname(target))
+  delay = 0
+  for attempt in range(DOWNLOAD_ATTEMPTS):
+    await asyncio.sleep(delay)
+    delay = 2 ** attempt + random.random()
 
-  async with session.get(source, allow_redirects=True) as r:
-    if 200 <= r.status < 300:
-      print(f'Downloading {source} to {target}')
-      open(target, 'wb').write(await r.read())
-    else:
-      print(f'Missing {source}')
-      open(target + '~', 'wb').write(bytes())
+    try:
+      async with session.get(source, allow_redirects=True) as r:
+        if 200 <= r.status < 300:
+          print(f'Downloading {source} to {target}')
+          async with aiofiles.open(target + '.part', 'wb') as f:
+            async for chunk in r.content.iter_any():
+              await f.write(chunk)
+          await asyncio.to_thread(os.replace, target + '.part', target)
+          return True
+
+        elif r.status == 429 or r.status >= 500:
+          print(f'Retrying {source} ({r.status})')
+          retry_after = r.headers.get('Retry-After', '')
+          if retry_after.isdigit():
+            delay = int(retry_after)
+
+        else:
+          print(f'Missing {source}')
+          await asyncio.to_thread(lambda: open(target + '~', 'wb').close())
+          return
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+      print(f'Retrying {source} ({e!r})')
 
+  print(f'Failed {source}')
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(target + '.part')
 
-async def execute(cmd, *args, **kwargs):
-  print(f'Executing "{cmd}"')
-  proc = await asyncio.create_subprocess_shell(cmd, *args, **kwargs)
-  stdout, stderr = await proc.communicate()
-  return (proc.returncode,
-          stdout.decode('utf-8') if stdout else None,
-          stderr.decode('utf-8') if stderr else None)
+
+def client_session():
+  import aiohttp
+
+  connector = aiohttp.TCPConnector(limit=64, limit_per_host=16,
+                                   ttl_dns_cache=600, keepalive_timeout=75,
+                                   enable_cleanup_closed=True)
+  return aiohttp.ClientSession(connector=connector)
+
+
+async def bounded(sem, coro):
+  async with sem:
+    try:
+      return await coro
+    except Exception as e:
+      print(f'Failed task ({e!r})')
+
+
+def ico2png(ico, png):
+  from PIL import Image
+
+  print(f'Converting {ico} to {png}')
+  try:
+    with Image.open(ico) as img:
+      if img.format == 'ICO':
+        img.size = max(img.info.get('sizes', [img.size]),
+                       key=lambda s: (s[1], s[0]))
+      img.save(png + '.part', 'PNG')
+    os.replace(png + '.part', png)
+  except (OSError, ValueError, SyntaxError, KeyError) as e:
+    print(f'Invalid {ico} ({e})')
 
 
 def titlecase(txt):
@@ -181,57 +460,179 @@ class SteamClient:
     self._appids = None
     self._apps = None
     self._cats = None
+    self._db = None
+    self._index = None
+    self._by_type = None
+    self._patterns = {}
     self.progress = progress
 
-  def load_cache(self):
-    if self._pkgs and self._pkgids and \
-       self._apps and self._appids:
-      return
+  @property
+  def db(self):
+    if not self._db:
+      self._db = sqlite3.connect(os.path.join(CACHE_DIR, 'cache.db'))
+      self._db.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+      version, = self._db.execute('PRAGMA user_version').fetchone()
+      if version != CACHE_VERSION:
+        remove_legacy_cache()
+        with contextlib.suppress(FileNotFoundError):
+          os.remove(os.path.join(CACHE_DIR, 'index.json'))
+        self._index = None
+        self._db.execute('DROP TABLE IF EXISTS pkgs')
+        self._db.execute('DROP TABLE IF EXISTS apps')
+        self._db.execute(f'PRAGMA user_version = {CACHE_VERSION}')
+      self._db.execute('CREATE TABLE IF NOT EXISTS pkgs '
+                       '(id INTEGER PRIMARY KEY, data BLOB)')
+      self._db.execute('CREATE TABLE IF NOT EXISTS apps '
+                       '(id INTEGER PRIMARY KEY, data BLOB)')
+      self._db.commit()
+    return self._db
 
-    pkgs_cache = os.path.join(CACHE_DIR, 'pkgs.json')
-    if os.path.exists(pkgs_cache):
-      with open(pkgs_cache, 'r') as f:
-        self._pkgs = dict(sorted([(int(k), v) for k,v in json.load(f).items()]))
+  @property
+  def index(self):
+    if not self._index:
+      path = os.path.join(CACHE_DIR, 'index.json')
+      if os.path.exists(path):
+        with open(path, 'rb') as f:
+          index = json_loads(f.read())
+        self._index = {'names': index['names'], 'ids': set(index['ids'])}
+
+    return self._index
+
+  def load_cache(self):
+    if self._pkgs is None:
+      pkgs = read_cache('pkgs')
+      if pkgs is None:
+        pkgs = self.cached('pkgs')
+        if pkgs:
+          write_cache('pkgs', pkgs)
+
+      if pkgs:
+        self._pkgs = pkgs
         self._pkgids = list(self._pkgs.keys())
 
-    apps_cache = os.path.join(CACHE_DIR, 'apps.json')
-    if os.path.exists(apps_cache):
-      with open(apps_cache, 'r') as f:
-        self._apps = dict(sorted([(int(k), v) for k,v in json.load(f).items()]))
+    if self._apps is None:
+      apps = read_cache('apps')
+      if apps is None:
+        apps = self.cached('apps')
+        if apps:
+          write_cache('apps', apps)
+          write_index(apps)
+
+      if apps:
+        self._apps = apps
         self._appids = list(self._apps.keys())
 
   def save_cache(self):
-    pkgs_cache = os.path.join(CACHE_DIR, 'pkgs.json')
+    self.db.commit()
+
     if self._pkgs:
-      with open(pkgs_cache, 'w') as f:
-        json.dump(self._pkgs, f)
+      write_cache('pkgs', self._pkgs)
 
-    apps_cache = os.path.join(CACHE_DIR, 'apps.json')
     if self._apps:
-      with open(apps_cache, 'w') as f:
-        json.dump(self._apps, f)
+      write_cache('apps', self._apps)
+      write_index(self._apps)
 
   def update_cache(self):
-    shutil.rmtree(CACHE_DIR)
-    os.makedirs(CACHE_DIR)
-    self._pkgs = None
+    stale = {t: {i for i, in self.db.execute(f'SELECT id FROM {t}')}
+             for t in ('pkgs', 'apps')}
+
+    self._pkgs = {}
     self._pkgids = None
-    self._apps = None
+    self._apps = {}
     self._appids = None
-    self.pkgs
-    self.apps
+    self._index = None
+    self._by_type = None
+
+    try:
+      self.fetch(self.pkgids, sorted(stale['apps']))
+
+      self._appids = pkg_appids(self._pkgs)
+      missing = [i for i in self._appids if i not in self._apps]
+      if missing:
+        self.fetch(appids=missing)
+      for i in set(self._apps) - set(self._appids):
+        del self._apps[i]
+
+      for t, cache in (('pkgs', self._pkgs), ('apps', self._apps)):
+        self.db.executemany(f'DELETE FROM {t} WHERE id = ?',
+                            ((i,) for i in stale[t] - set(cache)))
+      self.save_cache()
+
+    except BaseException:
+      self.db.rollback()
+      self._pkgs = None
+      self._pkgids = None
+      self._apps = None
+      self._appids = None
+      raise
+
+    shutil.rmtree(os.path.join(CACHE_DIR, 'protondb'), ignore_errors=True)
 
   def close_progress(self):
     self.progress(None)
 
   def expect(self, patterns, callbacks):
-      compiled = self.steam.compile_pattern_list([*patterns,
-                                                  '\x1b\[1m\r\nSteam>\x1b\[0m'])
+      key = tuple(patterns)
+      if key not in self._patterns:
+        self._patterns[key] = self.steam.compile_pattern_list([*key, PROMPT_RE])
+      compiled = self._patterns[key]
       i = self.steam.expect_list(compiled)
       while i < len(patterns):
         callbacks[i](*self.steam.match.groups())
         i = self.steam.expect_list(compiled)
 
+  def cached(self, table, ids=None):
+    ids = set(ids) if ids is not None else None
+    rows = self.db.execute(f'SELECT id, data FROM {table} ORDER BY id')
+    return dict((i, pickle.loads(d)) for i,d in rows
+                if ids is None or i in ids)
+
+  def runscript(self, cmds):
+    shards = [cmds[k:k + SHARD_SIZE] for k in range(0, len(cmds), SHARD_SIZE)]
+
+    with tempfile.NamedTemporaryFile(mode='w+') as s:
+      for k, shard in enumerate(shards):
+        for cmd in shard:
+          print(cmd, file=s)
+        print(f'echo __SHARD_{k}__', file=s)
+      s.flush()
+
+      blocks = []
+      self.steam.sendline(f'runscript "{s.name}"')
+      for k in range(len(shards)):
+        marker = re.compile(r'\n__SHARD_%d__\r\n' % k)
+        self.steam.expect(marker, timeout=None)
+        for m in BLOCK_RE.finditer(self.steam.before + '\n'):
+          blocks.append((int(m[1]), m[2]))
+        self.progress(100 * (k + 1) / len(shards))
+
+      self.steam.expect(PROMPT_RE, timeout=None, searchwindowsize=4096)
+      for m in BLOCK_RE.finditer(self.steam.before):
+        blocks.append((int(m[1]), m[2]))
+
+    return blocks
+
+  def fetch(self, pkgids=(), appids=()):
+    self.login()
+    what = [n for n, ids in (('pkgs', pkgids), ('apps', appids)) if ids]
+    self.progress(0, 'Loading ' + ' and '.join(what))
+    blocks = self.runscript([f'package_info_print {i}' for i in pkgids] +
+                            [f'app_info_print {i}' for i in appids])
+
+    pkgs = [b for b in blocks if b[1].lstrip().startswith('"packageid"')]
+    apps = [b for b in blocks if not b[1].lstrip().startswith('"packageid"')]
+    self.store('pkgs', self._pkgs, parse_blocks(pkgs, PKG_KEYS))
+    self.store('apps', self._apps, parse_blocks(apps))
+
+  def store(self, table, cache, items):
+    dumps = pickle.dumps
+    rows = []
+    append = rows.append
+    for i, v in items:
+      cache[i] = v
+      append((i, dumps(v, protocol=5)))
+    self.db.executemany(f'INSERT OR REPLACE INTO {table} VALUES (?, ?)', rows)
+
   def steam_file(self, path):
       file = os.path.join(STEAM_DIR, 'steam', path)
       if os.path.exists(file):
@@ -251,9 +652,11 @@ class SteamClient:
   def steam(self):
     if not self._steam:
       self._steam = pexpect.spawn('steamcmd +@ShutdownOnFailedCommand 0',
-                                  echo=False)
-      self.expect([r'\[([^\]]+)\] (Checking for available update|Downloading [Uu]pdate|Download complete)[^\n]+\r\n'],
-                  [lambda pct, txt: self.progress(int('0' + trydecode(pct).strip(' %-')), 'Updating')])
+                                  echo=False, maxread=1 << 20,
+                                  encoding='utf-8',
+                                  codec_errors='latin1-fallback')
+      self.expect([UPDATE_RE],
+                  [lambda pct, txt: self.progress(int('0' + pct.strip(' %-')), 'Updating')])
 
     return self._steam
 
@@ -279,11 +682,7 @@ class SteamClient:
 
       self.steam.sendline(f'login {username}')
       self.progress(0, 'Login')
-      self.expect([r'password:', r"Steam Guard code:", r'Two-factor code:',
-                   r'Logged in OK\r\n',
-                   r'FAILED login with result code ([^\n]+)\r\n',
-                   r"Logging in user '.*' to Steam Public \.\.\.\r\n",
-                   r"Waiting for user info\.\.\.OK\r\n"],
+      self.expect(LOGIN_RES,
                   [lambda: self.steam.sendline(getpass.getpass('Password: ')),
                    lambda: self.steam.sendline(input('Email code: ')),
                    lambda: self.steam.sendline(input('Two-factor code: ')),
@@ -301,42 +700,28 @@ class SteamClient:
       self.login()
 
       self.steam.sendline('licenses_print')
-      self.expect([r'License packageID (\d+):\r\n'],
+      self.expect([LICENSE_RE],
                   [lambda i: self.on_pkgid(int(i))])
 
-      self._pkgids = sorted(list(set(self._pkgids)))
+      self._pkgids = list(dict.fromkeys(self._pkgids))
       self.save_cache()
 
     return self._pkgids
 
-  def on_pkg(self, i, s):
-    with open(os.path.join(CACHE_DIR, f'pkg-{i}.vdf'), 'wb') as f:
-      f.write(s)
-    self._pkgs[i] = vdf.loads(trydecode(s))
-    self.progress(100 * len(self._pkgs) / len(self._pkgids))
-
   @property
   def pkgs(self):
+    if self._pkgs:
+      return self._pkgs
+
     self.load_cache()
     if not self._pkgs:
-      self._pkgs = {}
-      self.login()
-      self.progress(0, 'Loading pkgs')
-
-      with tempfile.NamedTemporaryFile(mode='w+') as s:
-        for i in self.pkgids:
-          cache = os.path.join(CACHE_DIR, f'pkg-{i}.vdf')
-          if os.path.exists(cache):
-            self.on_pkg(i, open(cache, 'rb').read())
-            continue
-          print(f'package_info_print {i}', file=s)
-        s.flush()
+      pkgids = self.pkgids
+      self._pkgs = self.cached('pkgs', pkgids)
 
-        self.steam.sendline(f'runscript "{s.name}"')
-        self.expect([r'"(\d+)"\r\n{\r\n((?:[^\n]*\r\n)*?)}\r\n'],
-                    [lambda i, s: self.on_pkg(int(i), s)])
+      missing = [i for i in pkgids if i not in self._pkgs]
+      if missing:
+        self.fetch(pkgids=missing)
 
-      self._pkgs = dict(sorted(self._pkgs.items()))
       self.save_cache()
 
     return self._pkgs
@@ -345,105 +730,100 @@ class SteamClient:
   def appids(self):
     self.load_cache()
     if not self._appids:
-      self._appids = []
-
-      for p in self.pkgs.values():
-        self._appids += list([int(i) for i in p['appids'].values()])
-
-      self._appids = list(set(self._appids))
+      self._appids = pkg_appids(self.pkgs)
       self.save_cache()
 
     return self._appids
 
-  def on_app(self, i, s):
-    with open(os.path.join(CACHE_DIR, f'app-{i}.vdf'), 'wb') as f:
-      f.write(s)
-    self._apps[i] = vdf.loads(trydecode(s))
-    self.progress(100 * len(self._apps) / len(self._appids))
-
   @property
   def apps(self):
+    if self._apps:
+      return self._apps
+
     self.load_cache()
     if not self._apps:
-      self._apps = {}
-      self.login()
-      self.progress(0, 'Loading apps')
-
-      with tempfile.NamedTemporaryFile(mode='w+') as s:
-        for i in self.appids:
-          cache = os.path.join(CACHE_DIR, f'app-{i}.vdf')
-          if os.path.exists(cache):
-            self.on_app(i, open(cache, 'rb').read())
-            continue
-          print(f'app_info_print {i}', file=s)
-        s.flush()
+      appids = self.appids
+      self._apps = self.cached('apps', appids)
 
-        self.steam.sendline(f'runscript "{s.name}"')
-        self.expect([r'"(\d+)"\r\n{\r\n((?:[^\n]*\r\n)*?)}\r\n'],
-                    [lambda i, s: self.on_app(int(i), s)])
+      missing = [i for i in appids if i not in self._apps]
+      if missing:
+        self.fetch(appids=missing)
 
-      self._apps = dict(sorted(self._apps.items()))
       self.save_cache()
 
     return self._apps
 
+  @property
+  def by_type(self):
+    if self._by_type is None:
+      self._by_type = {}
+      for k,v in self.apps.items():
+        if not 'common' in v:
+          continue
+        if 'driverversion' in v['common']:
+          continue
+        self._by_type.setdefault(v['common']['type'].lower(), []).append((k, v))
+
+      for t, apps in self._by_type.items():
+        apps.sort(key=lambda p: p[1]['common'].get('name', ''))
+        self._by_type[t] = dict(apps)
+
+    return self._by_type
+
+  def app(self, appid):
+    if self._apps:
+      return self._apps[appid]
+
+    row = self.db.execute('SELECT data FROM apps WHERE id = ?',
+                          (appid,)).fetchone()
+    if row:
+      return pickle.loads(row[0])
+
+    return self.apps[appid]
+
   def apps_by_type(self, t):
-    for k,v in self.apps.items():
-      if not 'common' in v:
-        continue
-      if 'driverversion' in v['common']:
-        continue
-      if v['common']['type'].lower() == t:
-        yield k,v
+    return self.by_type.get(t, {})
 
   @property
   def tools(self):
-    return dict(self.apps_by_type('tool'))
+    return self.apps_by_type('tool')
   @property
   def configs(self):
-    return dict(self.apps_by_type('config'))
+    return self.apps_by_type('config')
   @property
   def dlcs(self):
-    return dict(self.apps_by_type('dlc'))
+    return self.apps_by_type('dlc')
   @property
   def applications(self):
-    return dict(self.apps_by_type('application'))
+    return self.apps_by_type('application')
   @property
   def games(self):
-    return dict(self.apps_by_type('game'))
+    return self.apps_by_type('game')
   @property
   def demos(self):
-    return dict(self.apps_by_type('demo'))
+    return self.apps_by_type('demo')
 
   @property
   def cats(self):
     if not self._cats:
       import plyvel
 
-      if os.path.exists(os.path.join(CACHE_DIR, 'leveldb')):
-        shutil.rmtree(os.path.join(CACHE_DIR, 'leveldb'))
-      shutil.copytree(self.steam_file('config/htmlcache/Local Storage/leveldb'),
-                      os.path.join(CACHE_DIR, 'leveldb'))
-      db = plyvel.DB(os.path.join(CACHE_DIR, 'leveldb'))
-
-      keys = []
-      for k,v in db:
-        if not b'\x00\x01' in k:
-          continue
-
-        site, key = k.split(b'\x00\x01')
-        if site != b'_https://steamloopback.host':
-          continue
+      path = self.steam_file('config/htmlcache/Local Storage/leveldb')
+      try:
+        db = plyvel.DB(path, create_if_missing=False)
+      except plyvel.IOError:
+        copy = os.path.join(CACHE_DIR, 'leveldb')
+        shutil.rmtree(copy, ignore_errors=True)
+        shutil.copytree(path, copy)
+        db = plyvel.DB(copy)
 
-        if b'-cloud-storage-namespace-' in key and not b'.modified' in key:
-          assert(v[0] == 1)
-          keys.append(k)
+      with contextlib.closing(db):
+        values = [v for _,v in cloud_storage(db)]
 
       self._cats = dict((i,[]) for i in self.appids)
-      for k in keys:
-        v = []
-
-        for kk,vv in json.loads(db.get(k)[1:]):
+      loads = json_loads
+      for v in values:
+        for kk,vv in loads(v[1:]):
           if 'is_deleted' in vv and vv['is_deleted']:
             print(f'deleted: {vv}')
             pass
@@ -453,7 +833,7 @@ class SteamClient:
           elif vv['key'] == 'collection-bootstrap-complete':
             pass
           else:
-            vvv = json.loads(vv['value'])
+            vvv = loads(vv['value'])
             if not isinstance(vvv, dict) or not 'added' in vvv:
               continue
 
@@ -465,93 +845,114 @@ class SteamClient:
 
     return self._cats
 
-  async def _download_covers(self, s, i, k, v, sem, pct):
+  def _covers(self, k, v):
     SOURCE = 'https://steamcdn-a.akamaihd.net/steam{}/apps/{}/{}.{}'
     TARGET = os.path.join(CACHE_DIR, '{}/{}.{}')
 
-    await download(s, SOURCE.format('', k, 'library_600x900_2x', 'jpg'),
-                   TARGET.format('covers/600x900', k, 'jpg'))
-
-    await download(s, SOURCE.format('', k, 'library_600x900', 'jpg'),
-                   TARGET.format('covers/300x450', k, 'jpg'))
-
-    await download(s, SOURCE.format('', k, 'header', 'jpg'),
-                   TARGET.format('headers', k, 'jpg'))
-
-    await download(s, SOURCE.format('', k, 'logo', 'png'),
-                   TARGET.format('logos/640x360', k, 'png'))
+    urls = [(SOURCE.format('', k, 'library_600x900_2x', 'jpg'),
+             TARGET.format('covers/600x900', k, 'jpg')),
+            (SOURCE.format('', k, 'library_600x900', 'jpg'),
+             TARGET.format('covers/300x450', k, 'jpg')),
+            (SOURCE.format('', k, 'header', 'jpg'),
+             TARGET.format('headers', k, 'jpg')),
+            (SOURCE.format('', k, 'logo', 'png'),
+             TARGET.format('logos/640x360', k, 'png'))]
 
     if 'logo' in v['common']:
       n = v['common']['logo']
-      await download(s, SOURCE.format('community/public/images', k, n, 'jpg'),
-                     TARGET.format('logos/184x69', k, 'jpg'))
+      urls += [(SOURCE.format('community/public/images', k, n, 'jpg'),
+                TARGET.format('logos/184x69', k, 'jpg'))]
 
     if 'logo_small' in v['common']:
       n = v['common']['logo_small']
-      await download(s, SOURCE.format('community/public/images', k, n, 'jpg'),
-                     TARGET.format('logos/120x45', k, 'jpg'))
+      urls += [(SOURCE.format('community/public/images', k, n, 'jpg'),
+                TARGET.format('logos/120x45', k, 'jpg'))]
 
     if 'clienticon' in v['common']:
-      ico = TARGET.format('icons', k, 'ico')
-      png = TARGET.format('icons', k, 'png')
       n = v['common']['clienticon']
-      await download(s, SOURCE.format('community/public/images', k, n, 'ico'),
-                     ico)
+      urls += [(SOURCE.format('community/public/images', k, n, 'ico'),
+                TARGET.format('icons', k, 'ico'))]
 
-    async with sem:
-      if 'clienticon' in v['common']:
-        if os.path.exists(ico) and not os.path.exists(png):
-          _, n, _ = await execute("identify -quiet -format '%p %h %w %z %k\\n' "
-                                  "'{}' | sort -n -r -k2 -k3 -k4 -k5 | head -n1 "
-                                  "| awk '{{print $1}}'".format(ico),
-                                  stdout=subprocess.PIPE)
+    return urls
 
-          await execute('convert {} \\( -clone {} \\) -delete 0--2 {}'
-                        .format(ico, n.strip(), png))
+  async def _download_icon(self, download, ico, known, sem):
+    png = os.path.splitext(ico)[0] + '.png'
 
-    self.progress(-pct)
+    downloaded = await download
+    if os.path.basename(png) in known:
+      return
+    if not downloaded and os.path.basename(ico) not in known:
+      return
+
+    async with sem:
+      await asyncio.to_thread(ico2png, ico, png)
 
   async def download_covers(self):
-    import aiohttp
+    urls = [u for k,v in self.games.items() for u in self._covers(k, v)]
+    known = {}
+    for d in set(os.path.dirname(t) for _,t in urls):
+      os.makedirs(d, exist_ok=True)
+      known[d] = listdir(d)
 
     self.progress(0, 'Downloading')
 
-    connector = aiohttp.TCPConnector(limit=16)
-    sem = asyncio.Semaphore(16)
-    pct = 100. / len(self.games)
-    async with aiohttp.ClientSession(connector=connector) as s:
-      await asyncio.gather(*(self._download_covers(s, i, k, v, sem, pct)
-                             for i,(k,v) in enumerate(self.games.items())))
-
-  async def _download_protondb(self, s, i, k, v, pct):
+    net = asyncio.Semaphore(64)
+    cpu = asyncio.Semaphore(os.cpu_count() or 1)
+    pct = 100. / len(urls)
+    progress = self.progress
+    dirname = os.path.dirname
+    async with client_session() as s:
+      async with asyncio.TaskGroup() as tg:
+        for source, target in urls:
+          d = known[dirname(target)]
+          coro = bounded(net, download(s, source, target, d))
+          if target.endswith('.ico'):
+            coro = self._download_icon(coro, target, d, cpu)
+          t = tg.create_task(coro)
+          t.add_done_callback(lambda _: progress(-pct))
+
+  async def _download_protondb(self, s, k, known):
     SOURCE = 'https://www.protondb.com/api/v1/reports/summaries/{}.json'
     TARGET = os.path.join(CACHE_DIR, 'protondb/{}.json')
 
-    await download(s, SOURCE.format(k), TARGET.format(k))
+    await download(s, SOURCE.format(k), TARGET.format(k), known)
 
   async def download_protondb(self):
-    import aiohttp
+    path = os.path.join(CACHE_DIR, 'protondb')
+    os.makedirs(path, exist_ok=True)
 
-    connector = aiohttp.TCPConnector(limit=16)
-    pct = 100. / len(self.games)
-    async with aiohttp.ClientSession(connector=connector) as s:
-      await asyncio.gather(*(self._download_protondb(s, i, k, v, pct)
-                             for i,(k,v) in enumerate(self.games.items())))
+    known = listdir(path)
+    async with client_session() as s:
+      await asyncio.gather(*(self._download_protondb(s, k, known)
+                             for k in self.games))
 
     ratings = {}
 
-    for i,(k,v) in enumerate(self.games.items()):
-      file = os.path.join(CACHE_DIR, f'protondb/{k}.json')
-      if not os.path.exists(file):
+    known = listdir(path)
+    for k in self.games:
+      if f'{k}.json' not in known:
         continue
-      with open(file, 'r') as f:
-        ratings[k] = json.load(f)
+      with open(os.path.join(path, f'{k}.json'), 'rb') as f:
+        ratings[k] = json_loads(f.read())
 
     return ratings
 
   def id(self, **kwargs):
-    if kwargs.get('id', None) and kwargs['id'] in self.apps:
-      return int(kwargs['id'])
+    appid = None
+    if kwargs.get('id', None):
+      try:
+        appid = int(kwargs['id'])
+      except ValueError:
+        raise GameNotFoundError
+
+    if self.index:
+      if appid is not None and appid in self.index['ids']:
+        return appid
+      if kwargs.get('name', None) in self.index['names']:
+        return self.index['names'][kwargs['name']]
+
+    if appid is not None and appid in self.apps:
+      return appid
 
     elif kwargs.get('name', None):
       for a in self.apps.values():
@@ -564,25 +965,25 @@ class SteamClient:
     raise GameNotFoundError
 
   def list(self, **kwargs):
-    for a in sorted(self.games.values(), key=lambda g: g['common']['name']):
+    for a in self.games.values():
       kwargs['id'] = int(a['common']['gameid'])
       install_dir = self.install_dir(**kwargs)
       if not kwargs['installed'] or os.path.exists(install_dir):
         if kwargs['disk_usage'] and os.path.exists(install_dir):
-          print(subprocess.check_output(['du','-sh', install_dir]).split()[0].decode('utf-8'), end='\t')
+          print(human_size(disk_usage(install_dir)), end='\t')
         else:
           print(' ', end='\t')
         print(a['common']['name'])
 
   def show(self, **kwargs):
     kwargs['id'] = self.id(**kwargs)
-    print(json.dumps(self.apps[kwargs['id']], indent=2))
+    print(json_dumps(self.app(kwargs['id']), indent=True))
 
   def install_dir(self, **kwargs):
     if kwargs.get('install_dir', None):
       d = kwargs['install_dir']
     else:
-      d = self.apps[kwargs['id']]['config']['installdir']
+      d = self.app(kwargs['id'])['config']['installdir']
 
     d = os.path.join(os.path.expanduser(kwargs['games_dir']), d)
     d = os.path.expandvars(d)
@@ -609,9 +1010,8 @@ class SteamClient:
       s.flush()
 
       self.steam.sendline(f'runscript "{s.name}"')
-      self.expect([r'Update state .* (reconfiguring|downloading|validating), progress: ([\d]+).*\r\n',
-                   r"Success! App '{id}' fully installed\.\r\n".format(**kwargs)],
-                  [lambda txt, pct: self.progress(int(pct), titlecase(trydecode(txt))),
+      self.expect(INSTALL_RES,
+                  [lambda txt, pct: self.progress(int(pct), titlecase(txt)),
                    lambda: self.progress(100)])
 
   def command(self, **kwargs):
@@ -620,7 +1020,7 @@ class SteamClient:
     if not os.path.exists(kwargs['install_dir']):
       self.install(**kwargs)
 
-    app = self.apps[kwargs['id']]
+    app = self.app(kwargs['id'])
     print(app['config']['launch'])
     for v in app['config']['launch'].values():
       exe = os.path.join(kwargs['install_dir'], v['executable'])
@@ -638,7 +1038,7 @@ class SteamClient:
       subprocess.run(['wine', cmd])
 
   def categories(self):
-    for k,v in sorted(self.games.items(), key=lambda p: p[1]['common']['name']):
+    for k,v in self.games.items():
       print(v['common']['name'])
       for c in self.cats[k]:
         print(' ', c)
@@ -648,29 +1048,16 @@ class SteamClient:
     db = plyvel.DB(self.steam_file('config/htmlcache/Local Storage/leveldb'))
     pdb = asyncio.run(self.download_protondb())
 
-    keys = []
-    for k,v in db:
-      if not b'\x00\x01' in k:
-        continue
-
-      site, key = k.split(b'\x00\x01')
-      if site != b'_https://steamloopback.host':
-        continue
-
-      if b'-cloud-storage-namespace-' in key and not b'.modified' in key:
-        assert(v[0] == 1)
-        keys.append(k)
-
-    for k in keys:
+    for k,v in list(cloud_storage(db)):
       cats = {}
 
-      for key, cat in json.loads(db.get(k)[1:]):
+      for key, cat in json_loads(v[1:]):
         if not 'value' in cat or not 'key' in cat:
           cats[key] = cat
         elif cat['key'] == 'collection-bootstrap-complete':
           cats[key] = cat
         else:
-          val = json.loads(cat['value'])
+          val = json_loads(cat['value'])
           if not isinstance(val, dict) or not 'added' in val:
             cats[key] = cat
             continue
@@ -687,7 +1074,7 @@ class SteamClient:
         val = {'id': id, 'name': name.title(), 'added': [], 'removed': []}
         cat = {'key': key, 'timestamp': 1584215160,
                'conflictResolutionMethod': 'last-write',
-               'value': json.dumps(val, separators=(',',':'))}
+               'value': json_dumps(val)}
         cats[key] = cat
         print(f'creating {name} category')
 
@@ -707,47 +1094,46 @@ class SteamClient:
         elif cat['key'] == 'collection-bootstrap-complete':
           continue
         else:
-          val = json.loads(cat['value'])
+          val = json_loads(cat['value'])
           if not isinstance(val, dict) or not 'added' in val:
             continue
 
           if 'All' == val['name']:
             val['added'] = [i for i in self.games.keys()]
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           elif 'Proton Unrated' == val['name']:
             val['added'] = [i for i in self.games.keys() if i not in pdb]
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           elif 'Proton Borked' == val['name']:
             val['added'] = [i for i in self.games.keys()
                             if i in pdb and pdb[i]['tier'] == 'borked']
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           elif 'Proton Bronze' == val['name']:
             val['added'] = [i for i in self.games.keys()
                             if i in pdb and pdb[i]['tier'] == 'bronze']
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           elif 'Proton Silver' == val['name']:
             val['added'] = [i for i in self.games.keys()
                             if i in pdb and pdb[i]['tier'] == 'silver']
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           elif 'Proton Gold' == val['name']:
             val['added'] = [i for i in self.games.keys()
                             if i in pdb and pdb[i]['tier'] == 'gold']
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           elif 'Proton Platinum' == val['name']:
             val['added'] = [i for i in self.games.keys()
                             if i in pdb and pdb[i]['tier'] == 'platinum']
-            cat['value'] = json.dumps(val, separators=(',',':'))
+            cat['value'] = json_dumps(val)
 
           cats[key] = cat
 
-      cats = json.dumps([[key, cat] for key, cat in cats.items()],
-                        separators=(',',':'))
+      cats = json_dumps([[key, cat] for key, cat in cats.items()])
       db.put(k, '\x01{}'.format(cats).encode('utf-8'), sync=True)
 
 def main():